@@ -0,0 +1,190 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator
+
+from utils_logger import setup_logger
+
+logger = setup_logger("upay.admission")
+
+# Per-source token buckets: UPAY_ADMIT_RATES="app=20,website=10,other=5" overrides the default rate.
+ADMIT_RATE = float(os.getenv("UPAY_ADMIT_RATE", "20"))
+ADMIT_BURST = float(os.getenv("UPAY_ADMIT_BURST", "40"))
+ADMIT_RATES = os.getenv("UPAY_ADMIT_RATES", "")
+# Sources with a bucket of their own; any other client-supplied source shares one.
+KNOWN_SOURCES = frozenset(("app", "website", "database", "terminal"))
+OTHER_SOURCE = "other"
+# Whole-request concurrency (offline path included) and how long a request may queue for it.
+MAX_IN_FLIGHT = int(os.getenv("UPAY_MAX_IN_FLIGHT", "32"))
+QUEUE_TIMEOUT_SEC = float(os.getenv("UPAY_QUEUE_TIMEOUT_SEC", "0.5"))
+# Online (LLM) stage concurrency and how long a request with a deadline may wait for a slot.
+ONLINE_MAX_IN_FLIGHT = int(os.getenv("UPAY_ONLINE_MAX_IN_FLIGHT", "8"))
+ONLINE_QUEUE_TIMEOUT_SEC = float(os.getenv("UPAY_ONLINE_QUEUE_TIMEOUT_SEC", "0.25"))
+# Per priority class caps on the online stage (see scheduler.PRIORITY_CLASSES).
+ONLINE_CLASS_CAPS = os.getenv("UPAY_ONLINE_CLASS_CAPS", "website=6,database=3")
+# End-to-end budget for a request; online work is skipped once it has run out.
+REQUEST_DEADLINE_SEC = float(os.getenv("UPAY_REQUEST_DEADLINE_SEC", "10"))
+RETRY_AFTER_SEC = int(os.getenv("UPAY_RETRY_AFTER_SEC", "1"))
+
+
+def _parse_rates(spec: str) -> Dict[str, float]:
+    rates: Dict[str, float] = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            rates[name.strip()] = float(value)
+        except ValueError:
+            logger.warning("Ignoring invalid admission rate %r", part)
+    return rates
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries a Retry-After hint."""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_take(self) -> float:
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            if self.rate <= 0:
+                return float(RETRY_AFTER_SEC)
+            return (1.0 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Bounds work admitted into process_message and into the online stage.
+
+    Requests first take a token from their source's bucket, then wait at most
+    QUEUE_TIMEOUT_SEC for one of MAX_IN_FLIGHT slots; failing either raises
+    AdmissionRejected so the endpoint can answer 429. A slot is held until the
+    admitted work completes, so MAX_IN_FLIGHT bounds running work even when
+    the handler stops waiting. Inside the agent, the online stage gets its
+    own, smaller pool; when no slot frees up before the request's deadline the
+    agent degrades to an offline-only decision.
+    """
+
+    def __init__(self) -> None:
+        self._rates = _parse_rates(ADMIT_RATES)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._inflight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+        self._online = threading.BoundedSemaphore(ONLINE_MAX_IN_FLIGHT)
+        self._online_class = {
+            name: threading.BoundedSemaphore(max(1, int(cap)))
+            for name, cap in _parse_rates(ONLINE_CLASS_CAPS).items()
+        }
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            "admitted": 0,
+            "rejected_rate": 0,
+            "rejected_busy": 0,
+            "in_flight": 0,
+            "online_in_flight": 0,
+            "degraded": 0,
+        }
+
+    def _bump(self, key: str, delta: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[key] += delta
+
+    def _bucket(self, source: str) -> TokenBucket:
+        # Keyed on a fixed set so arbitrary `source` values can neither grow the
+        # table nor mint fresh buckets to dodge the limit.
+        key = source if source in KNOWN_SOURCES else OTHER_SOURCE
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                rate = self._rates.get(key, ADMIT_RATE)
+                bucket = TokenBucket(rate, max(ADMIT_BURST, rate))
+                self._buckets[key] = bucket
+            return bucket
+
+    def admit(self, source: str) -> float:
+        """Admit one request from `source`; returns its monotonic deadline.
+
+        The in-flight slot stays held until release() is called, which must
+        happen when the work finishes rather than when the handler returns.
+        """
+        wait = self._bucket(source).try_take()
+        if wait > 0:
+            self._bump("rejected_rate")
+            raise AdmissionRejected("rate limit exceeded for source %r" % source, max(1, math.ceil(wait)))
+        if not self._inflight.acquire(timeout=QUEUE_TIMEOUT_SEC):
+            self._bump("rejected_busy")
+            raise AdmissionRejected("server busy", RETRY_AFTER_SEC)
+        self._bump("admitted")
+        self._bump("in_flight")
+        return time.monotonic() + REQUEST_DEADLINE_SEC
+
+    def release(self) -> None:
+        """Give back the in-flight slot taken by a successful admit()."""
+        self._bump("in_flight", -1)
+        self._inflight.release()
+
+    @contextmanager
+    def online_slot(self, deadline: Optional[float] = None, klass: Optional[str] = None) -> Iterator[bool]:
+        """Try to enter the online stage; yields False when saturated or out of time.
+
+        Only requests with a deadline (interactive HTTP traffic) degrade; work
+        without one, such as the DB backlog, blocks until a slot frees up so it
+        is never finalized from a degraded decision.
+
+        `klass` is the request's scheduler priority class; classes listed in
+        ONLINE_CLASS_CAPS must also get one of their own slots.
+        """
+        limit = None if deadline is None else min(time.monotonic() + ONLINE_QUEUE_TIMEOUT_SEC, deadline)
+        class_sem = self._online_class.get(klass) if klass else None
+        if class_sem is not None and not self._acquire_until(class_sem, limit):
+            self._bump("degraded")
+            yield False
+            return
+        if not self._acquire_until(self._online, limit):
+            if class_sem is not None:
+                class_sem.release()
+            self._bump("degraded")
+            yield False
+            return
+        self._bump("online_in_flight")
+        try:
+            yield True
+        finally:
+            self._bump("online_in_flight", -1)
+            self._online.release()
+            if class_sem is not None:
+                class_sem.release()
+
+    @staticmethod
+    def _acquire_until(sem: threading.BoundedSemaphore, limit: Optional[float]) -> bool:
+        if limit is None:
+            return sem.acquire()
+        timeout = limit - time.monotonic()
+        return sem.acquire(timeout=timeout) if timeout > 0 else sem.acquire(blocking=False)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+
+admission = AdmissionController()
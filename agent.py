@@ -1,11 +1,17 @@
-from typing import TypedDict, Optional, Dict, Any
-from langgraph.graph import StateGraph, END
+import os
+from typing import TypedDict, Optional, Dict, Any, List
 from utils_logger import setup_logger
 from offline_model import offline_model
 from online_model import online_llm, normalize_label
+from admission import admission
+from profiler import profiler
 
 logger = setup_logger("upay.agent")
 
+# "langgraph" compiles a StateGraph; "native" runs the same nodes directly and
+# never imports langgraph.
+AGENT_EXECUTOR = os.getenv("UPAY_AGENT_EXECUTOR", "langgraph").strip().lower()
+
 
 class AgentState(TypedDict, total=False):
     input_text: str
@@ -13,9 +19,13 @@ class AgentState(TypedDict, total=False):
     online_label: Optional[str]
     final_label: Optional[str]
     after_hours: bool
+    deadline: Optional[float]
+    priority_class: Optional[str]
+    degraded: bool
     meta: Dict[str, Any]
 
 
+@profiler.traced("graph.offline")
 def offline_node(state: AgentState) -> AgentState:
     text = state.get("input_text", "")
     label = offline_model.predict(text)
@@ -24,9 +34,14 @@ def offline_node(state: AgentState) -> AgentState:
     return {"offline_label": label}
 
 
+@profiler.traced("graph.online")
 def online_node(state: AgentState) -> AgentState:
     text = state.get("input_text", "")
-    label = online_llm.predict(text)
+    with admission.online_slot(state.get("deadline"), state.get("priority_class")) as acquired:
+        if not acquired:
+            logger.warning("Online stage saturated; degrading to offline-only decision")
+            return {"online_label": None, "degraded": True}
+        label = online_llm.predict(text)
     label = normalize_label(label) if isinstance(label, str) else label
     logger.info("Online label: %s", label)
     return {"online_label": label}
@@ -39,6 +54,7 @@ def route_after_offline(state: AgentState) -> str:
     return "finalize"
 
 
+@profiler.traced("graph.finalize")
 def finalize_node(state: AgentState) -> AgentState:
     offline_lab = state.get("offline_label")
     online_lab = state.get("online_label")
@@ -50,7 +66,10 @@ def finalize_node(state: AgentState) -> AgentState:
         origin = "offline"
     else:
         chosen = online_lab or "Mediate"
-        origin = "online" if online_lab else "default"
+        if state.get("degraded"):
+            origin = "degraded"
+        else:
+            origin = "online" if online_lab else "default"
 
     if after_hours and chosen == "Mediate":
         # After 9 PM, mediate is treated as fraud before sending results
@@ -66,7 +85,9 @@ def finalize_node(state: AgentState) -> AgentState:
     return {"final_label": chosen, "meta": meta}
 
 
-def build_agent():
+def build_langgraph_agent():
+    from langgraph.graph import StateGraph, END
+
     g = StateGraph(AgentState)
     g.add_node("offline", offline_node)
     g.add_node("online", online_node)
@@ -80,5 +101,60 @@ def build_agent():
     return g.compile()
 
 
-# Singleton compiled graph
+class PipelineState:
+    """Slotted stand-in for AgentState; exposes the dict-style get() the nodes use."""
+
+    __slots__ = tuple(AgentState.__annotations__)
+
+    def __init__(self, values: Dict[str, Any]) -> None:
+        self.update(values)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def update(self, values: Optional[Dict[str, Any]]) -> None:
+        if values:
+            for key, value in values.items():
+                setattr(self, key, value)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}
+
+
+class NativeAgent:
+    """Runs offline -> (online) -> finalize directly, with the same interface as
+    the compiled graph (invoke/batch over plain dicts)."""
+
+    def invoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        st = PipelineState(state)
+        st.update(offline_node(st))
+        if route_after_offline(st) == "online":
+            st.update(online_node(st))
+        st.update(finalize_node(st))
+        return st.to_dict()
+
+    def batch(self, states: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # Stage-at-a-time so the offline pass stays hot before any LLM calls.
+        sts = [PipelineState(s) for s in states]
+        for st in sts:
+            st.update(offline_node(st))
+        for st in sts:
+            if route_after_offline(st) == "online":
+                st.update(online_node(st))
+        for st in sts:
+            st.update(finalize_node(st))
+        return [st.to_dict() for st in sts]
+
+
+def build_agent(executor: Optional[str] = None):
+    executor = executor or AGENT_EXECUTOR
+    if executor == "native":
+        logger.info("Using native pipeline executor")
+        return NativeAgent()
+    if executor != "langgraph":
+        logger.warning("Unknown UPAY_AGENT_EXECUTOR %r; using langgraph", executor)
+    return build_langgraph_agent()
+
+
+# Singleton compiled graph (or native executor, per UPAY_AGENT_EXECUTOR)
 agent_graph = build_agent()
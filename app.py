@@ -1,24 +1,47 @@
 import argparse
+import hmac
 import json
 import threading
 import time
+from concurrent.futures import TimeoutError as FuturesTimeout
 from datetime import datetime
 from typing import Optional, Dict, Any
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
 
 from utils_logger import setup_logger
 from agent import agent_graph
+from admission import admission, AdmissionRejected, RETRY_AFTER_SEC
+from profiler import profiler, ADMIN_TOKEN
+from scheduler import scheduler, class_for_source, QueueFull
+from input_limits import MAX_BODY_BYTES, MAX_TEXT_CHARS, truncate_head_tail
 from db import insert_message, find_unprocessed, update_result, mark_error, get_message_by_id
 
 logger = setup_logger("upay.app")
 
 app = Flask(__name__)
 application = app
+# One byte of headroom so a truncated chunked read can be told from a body of exactly MAX_BODY_BYTES.
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES + 1
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
 
+@app.before_request
+def _reject_oversized_body():
+    length = request.content_length
+    if length is not None and length > MAX_BODY_BYTES:
+        return jsonify({"error": "request body too large", "max_bytes": MAX_BODY_BYTES}), 413
+    if length is None and request.method in ("POST", "PUT", "PATCH"):
+        # Chunked bodies have no declared length and werkzeug silently stops
+        # reading at MAX_CONTENT_LENGTH, so buffer (bounded) and check here.
+        # JSON/form parsing later reads from this cache.
+        if len(request.get_data(cache=True)) > MAX_BODY_BYTES:
+            return jsonify({"error": "request body too large", "max_bytes": MAX_BODY_BYTES}), 413
+    return None
+
+
 
 def is_after_hours(now: Optional[datetime] = None) -> bool:
     now = now or datetime.now()
@@ -26,9 +49,11 @@ def is_after_hours(now: Optional[datetime] = None) -> bool:
 
 
 
-def run_agent(text: str, after_hours: bool) -> Dict[str, Any]:
-    state = {"input_text": text, "after_hours": after_hours}
-    out = agent_graph.invoke(state)
+def run_agent(text: str, after_hours: bool, deadline: Optional[float] = None,
+              priority_class: Optional[str] = None) -> Dict[str, Any]:
+    state = {"input_text": text, "after_hours": after_hours, "deadline": deadline, "priority_class": priority_class}
+    with profiler.span("agent.invoke"):
+        out = agent_graph.invoke(state)
     result = out.get("final_label", "Mediate")
     meta = out.get("meta", {})
     return {"result": result, "meta": meta}
@@ -50,12 +75,20 @@ def send_to_website(payload: Dict[str, Any]) -> None:
 
 
 
-def process_message(source: str, message: str) -> Dict[str, Any]:
+def process_message(source: str, message: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+    with profiler.profile_request("process_message"):
+        return _process_message(source, message, deadline)
+
+
+def _process_message(source: str, message: str, deadline: Optional[float] = None) -> Dict[str, Any]:
+    if len(message) > MAX_TEXT_CHARS:
+        logger.info("Truncating %s message from %d to %d chars", source, len(message), MAX_TEXT_CHARS)
+        message = truncate_head_tail(message, MAX_TEXT_CHARS)
     after_hours_flag = is_after_hours()
     msg_id = insert_message(source=source, message=message, after_hours=after_hours_flag)
 
     try:
-        agent_out = run_agent(message, after_hours_flag)
+        agent_out = run_agent(message, after_hours_flag, deadline, class_for_source(source))
         result = agent_out["result"]
         payload = {
             "id": msg_id,
@@ -106,19 +139,26 @@ def process_message(source: str, message: str) -> Dict[str, Any]:
 
 
 def _extract_text_from_request() -> str:
-    """Extract text from JSON, form, args, or raw body."""
+    """Extract text from JSON, form, args, or raw body.
+
+    HTTP errors (e.g. an oversized body) propagate so the caller can answer them.
+    """
     try:
         if request.is_json:
             data = request.get_json(silent=True) or {}
             text = data.get("text") or data.get("message") or ""
             if text:
                 return str(text)
+    except HTTPException:
+        raise
     except Exception:
         pass
     try:
         text = request.form.get("text") or request.form.get("message")
         if text:
             return str(text)
+    except HTTPException:
+        raise
     except Exception:
         pass
     text = request.args.get("text") or request.args.get("message")
@@ -127,21 +167,72 @@ def _extract_text_from_request() -> str:
     try:
         if request.data:
             return request.data.decode("utf-8", errors="ignore").strip()
+    except HTTPException:
+        raise
     except Exception:
         pass
     return ""
 
 
+def _too_many(source: str, reason: str, retry_after: int):
+    logger.warning("Rejected %s request: %s (retry after %ss)", source, reason, retry_after)
+    resp = jsonify({"error": reason, "retry_after": retry_after})
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp, 429
+
+
+def _never_started(future) -> bool:
+    # Cancelled here, or failed by the scheduler because it expired in queue.
+    if future.cancel() or future.cancelled():
+        return True
+    return future.done() and isinstance(future.exception(), TimeoutError)
+
+
+def _admitted_process(source: str, message: str):
+    """Run process_message on the shared scheduler under admission control;
+    429 with Retry-After if rejected or not started before the deadline."""
+    try:
+        deadline = admission.admit(source)
+    except AdmissionRejected as e:
+        return _too_many(source, e.reason, e.retry_after)
+    try:
+        future = scheduler.submit(class_for_source(source), process_message, source, message, deadline,
+                                  deadline=deadline)
+    except QueueFull as e:
+        admission.release()
+        return _too_many(source, str(e), RETRY_AFTER_SEC)
+    # The in-flight slot follows the work, not this handler.
+    future.add_done_callback(lambda _f: admission.release())
+    try:
+        payload = future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except (TimeoutError, FuturesTimeout):
+        if _never_started(future):
+            return _too_many(source, "request timed out in queue", RETRY_AFTER_SEC)
+        # Already running: the message is stored and will be classified, so a
+        # retry would only duplicate it. Wait for the result instead.
+        payload = future.result()
+    return jsonify(payload), 200
+
+
 @app.post("/api/message")
 def receive_message():
     try:
         data = request.get_json(force=True)
         message = data.get("message", "")
-        source = data.get("source", "website")  # default website
+        # Source picks the priority class, token bucket and online cap, so only
+        # trusted callers may choose it; everyone else is website traffic.
+        source = "website"
+        claimed = data.get("source")
+        if claimed and claimed != source:
+            if _is_admin():
+                source = str(claimed)
+            else:
+                logger.info("Ignoring unauthenticated source %r on /api/message", claimed)
         if not message:
             return jsonify({"error": "message is required"}), 400
-        payload = process_message(source, message)
-        return jsonify(payload), 200
+        return _admitted_process(source, message)
+    except RequestEntityTooLarge:
+        return jsonify({"error": "request body too large", "max_bytes": MAX_BODY_BYTES}), 413
     except Exception as e:
         logger.error("/api/message error: %s", e)
         return jsonify({"error": str(e)}), 500
@@ -153,8 +244,9 @@ def app_message():
         text = _extract_text_from_request()
         if not text:
             return jsonify({"error": "text or message is required"}), 400
-        payload = process_message("app", text)
-        return jsonify(payload), 200
+        return _admitted_process("app", text)
+    except RequestEntityTooLarge:
+        return jsonify({"error": "request body too large", "max_bytes": MAX_BODY_BYTES}), 413
     except Exception as e:
         logger.error("/api/app/message error: %s", e)
         return jsonify({"error": str(e)}), 500
@@ -166,8 +258,9 @@ def app_process_get():
         text = _extract_text_from_request()
         if not text:
             return jsonify({"error": "text query param is required"}), 400
-        payload = process_message("app", text)
-        return jsonify(payload), 200
+        return _admitted_process("app", text)
+    except RequestEntityTooLarge:
+        return jsonify({"error": "request body too large", "max_bytes": MAX_BODY_BYTES}), 413
     except Exception as e:
         logger.error("/api/app/process error: %s", e)
         return jsonify({"error": str(e)}), 500
@@ -181,7 +274,12 @@ def app_get_result(id: str):
 
 @app.get("/health")
 def health():
-    return jsonify({"status": "ok", "time": int(time.time())})
+    return jsonify({
+        "status": "ok",
+        "time": int(time.time()),
+        "admission": admission.snapshot(),
+        "scheduler": scheduler.snapshot(),
+    })
 
 
 @app.get("/")
@@ -211,6 +309,78 @@ def get_result(id: str):
 
 
 
+def _is_admin() -> bool:
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+@app.post("/api/admin/profile")
+def admin_profile_start():
+    """Profile the next N requests and/or T seconds; optionally record trace spans."""
+    if not _is_admin():
+        return jsonify({"error": "forbidden"}), 403
+    try:
+        data = request.get_json(silent=True) or {}
+        requests_limit = data.get("requests")
+        seconds = data.get("seconds")
+        session = profiler.start(
+            mode=str(data.get("mode", "sample")),
+            requests=int(requests_limit) if requests_limit is not None else None,
+            seconds=float(seconds) if seconds is not None else None,
+            interval_ms=float(data.get("interval_ms", 5.0)),
+            all_threads=bool(data.get("all_threads", False)),
+            trace=bool(data.get("trace", False)),
+        )
+        return jsonify(session.summary()), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logger.error("/api/admin/profile start error: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.delete("/api/admin/profile")
+def admin_profile_stop():
+    if not _is_admin():
+        return jsonify({"error": "forbidden"}), 403
+    session = profiler.stop()
+    if session is None:
+        return jsonify({"error": "no profiling session"}), 404
+    return jsonify(session.summary()), 200
+
+
+@app.get("/api/admin/profile")
+def admin_profile_report():
+    """Report the current/last session: format=json (default), collapsed or pstats."""
+    if not _is_admin():
+        return jsonify({"error": "forbidden"}), 403
+    session = profiler.session
+    if session is None:
+        return jsonify({"error": "no profiling session"}), 404
+    fmt = request.args.get("format", "json")
+    top_n = request.args.get("top", 25, type=int)
+    if fmt == "collapsed":
+        return session.collapsed() + "\n", 200, {"Content-Type": "text/plain; charset=utf-8"}
+    if fmt == "pstats":
+        return session.pstats_text(top_n), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    out = session.summary()
+    out["top"] = session.top(top_n)
+    return jsonify(out), 200
+
+
+@app.get("/api/admin/traces")
+def admin_traces():
+    if not _is_admin():
+        return jsonify({"error": "forbidden"}), 403
+    spans = profiler.query_spans(
+        trace_id=request.args.get("trace_id"),
+        name=request.args.get("name"),
+        limit=request.args.get("limit", 200, type=int),
+    )
+    return jsonify({"spans": spans}), 200
+
+
+
 class DBPoller(threading.Thread):
     def __init__(self, interval_sec: int = 60):
         super().__init__(daemon=True)
@@ -222,12 +392,20 @@ class DBPoller(threading.Thread):
         while not self._stop.is_set():
             try:
                 docs = find_unprocessed(limit=100)
+                pending = []
                 for doc in docs:
+                    message = doc.get("message", "")
+                    if not message:
+                        continue
                     try:
-                        message = doc.get("message", "")
-                        if not message:
-                            continue
-                        process_message("database", message)
+                        pending.append((doc, scheduler.submit("database", process_message, "database", message)))
+                    except QueueFull as e:
+                        logger.warning("DB Poller backlog queue full; deferring rest of sweep: %s", e)
+                        break
+                # Wait for this sweep so the next one doesn't resubmit the same documents.
+                for doc, future in pending:
+                    try:
+                        future.result()
                     except Exception as e:
                         logger.error("Error processing DB doc %s: %s", doc.get("_id"), e)
                 time.sleep(self.interval)
@@ -261,6 +439,7 @@ def main():
     parser.add_argument("--host", default="0.0.0.0")
     parser.add_argument("--port", type=int, default=8000)
     parser.add_argument("--no-poller", action="store_true", help="Disable DB poller")
+    parser.add_argument("--no-distill", action="store_true", help="Disable background distillation of LLM verdicts")
     parser.add_argument("--interactive", action="store_true", help="Interactive CLI test mode (for testing only)")
     args = parser.parse_args()
 
@@ -269,6 +448,13 @@ def main():
         poller = DBPoller()
         poller.start()
 
+    learner = None
+    if not args.no_distill:
+        from distill import DistillLearner
+
+        learner = DistillLearner()
+        learner.start()
+
     if args.interactive:
         interactive_loop()
     else:
@@ -5,6 +5,7 @@ from pymongo import MongoClient, ReturnDocument
 from pymongo.errors import PyMongoError
 from bson import ObjectId  # type: ignore
 from utils_logger import setup_logger
+from profiler import profiler
 
 logger = setup_logger("upay.db")
 
@@ -46,6 +47,7 @@ def get_collection():
     if client is None:
         return None
     return client[DB_NAME][COLLECTION_NAME]
+@profiler.traced("db.insert_message")
 def insert_message(source: str, message: str, after_hours: bool) -> Optional[str]:
     col = get_collection()
     if col is None:
@@ -67,6 +69,7 @@ def insert_message(source: str, message: str, after_hours: bool) -> Optional[str
     except PyMongoError as e:
         logger.error("Insert failed: %s", e)
         return None
+@profiler.traced("db.find_unprocessed")
 def find_unprocessed(limit: int = 50) -> List[Dict[str, Any]]:
     col = get_collection()
     if col is None:
@@ -77,6 +80,7 @@ def find_unprocessed(limit: int = 50) -> List[Dict[str, Any]]:
     except PyMongoError as e:
         logger.error("Query unprocessed failed: %s", e)
         return []
+@profiler.traced("db.update_result")
 def update_result(doc_id, result: str, meta: Optional[Dict[str, Any]] = None) -> bool:
     col = get_collection()
     if col is None:
@@ -100,6 +104,7 @@ def update_result(doc_id, result: str, meta: Optional[Dict[str, Any]] = None) ->
     except Exception as e:
         logger.error("Update failed (generic): %s", e)
         return False
+@profiler.traced("db.mark_error")
 def mark_error(doc_id, error: str) -> None:
     col = get_collection()
     if col is None:
@@ -111,6 +116,7 @@ def mark_error(doc_id, error: str) -> None:
         )
     except Exception as e:
         logger.error("Mark error failed: %s", e)
+@profiler.traced("db.get_message_by_id")
 def get_message_by_id(doc_id) -> Optional[Dict[str, Any]]:
     """Fetch a single message document by id (str or ObjectId)."""
     col = get_collection()
@@ -122,4 +128,33 @@ def get_message_by_id(doc_id) -> Optional[Dict[str, Any]]:
         return doc
     except Exception as e:
         logger.error("get_message_by_id failed: %s", e)
-        return None
\ No newline at end of file
+        return None
+@profiler.traced("db.find_distill_samples")
+def find_distill_samples(since: int = 0, after_id=None, limit: int = 500) -> List[Dict[str, Any]]:
+    """Fetch processed messages that carry an online (LLM) label, ordered by
+    (updated_at, _id) and starting strictly after (since, after_id) when
+    after_id is given, so callers can page through documents sharing a second."""
+    col = get_collection()
+    if col is None:
+        return []
+    query: Dict[str, Any] = {
+        "status": "processed",
+        "meta.online_label": {"$in": ["Fraud", "Not Fraud", "Mediate"]},
+    }
+    if after_id is None:
+        query["updated_at"] = {"$gte": since}
+    else:
+        query["$or"] = [
+            {"updated_at": {"$gt": since}},
+            {"updated_at": since, "_id": {"$gt": after_id}},
+        ]
+    try:
+        cursor = col.find(
+            query,
+            {"message": 1, "meta.online_label": 1, "updated_at": 1},
+            limit=limit,
+        ).sort([("updated_at", 1), ("_id", 1)])
+        return list(cursor)
+    except PyMongoError as e:
+        logger.error("Query distill samples failed: %s", e)
+        return []
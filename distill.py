@@ -0,0 +1,224 @@
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import deque
+from typing import Optional, List, Tuple, Dict, Any
+
+from utils_logger import setup_logger
+
+try:
+    from sklearn.feature_extraction.text import HashingVectorizer  # type: ignore
+    from sklearn.linear_model import SGDClassifier  # type: ignore
+except Exception as _e:
+    HashingVectorizer = None
+    SGDClassifier = None
+
+logger = setup_logger("upay.distill")
+
+LABELS = ["Fraud", "Not Fraud", "Mediate"]
+
+DISTILL_INTERVAL_SEC = int(os.getenv("UPAY_DISTILL_INTERVAL_SEC", "300"))
+DISTILL_BATCH_LIMIT = int(os.getenv("UPAY_DISTILL_BATCH_LIMIT", "500"))
+DISTILL_HOLDOUT_EVERY = int(os.getenv("UPAY_DISTILL_HOLDOUT_EVERY", "5"))
+DISTILL_HOLDOUT_MAX = int(os.getenv("UPAY_DISTILL_HOLDOUT_MAX", "2000"))
+DISTILL_MIN_HOLDOUT = int(os.getenv("UPAY_DISTILL_MIN_HOLDOUT", "50"))
+DISTILL_MAX_ERROR_RATE = float(os.getenv("UPAY_DISTILL_MAX_ERROR_RATE", "0.02"))
+
+
+class DistilledModel:
+    """Hashing-vectorizer + SGD classifier trained incrementally on LLM verdicts.
+
+    Stateless hashing keeps the feature space fixed, so the model can be updated
+    with partial_fit without refitting a vocabulary.
+    """
+
+    def __init__(self, n_features: int = 2 ** 18) -> None:
+        if HashingVectorizer is None or SGDClassifier is None:
+            raise RuntimeError("scikit-learn is required for the distilled model")
+        self.vectorizer = HashingVectorizer(
+            n_features=n_features,
+            alternate_sign=False,
+            ngram_range=(1, 2),
+            lowercase=True,
+        )
+        self.clf = SGDClassifier(loss="log_loss", alpha=1e-5, random_state=0)
+        self.n_seen = 0
+
+    def partial_fit(self, texts: List[str], labels: List[str]) -> None:
+        if not texts:
+            return
+        X = self.vectorizer.transform(texts)
+        self.clf.partial_fit(X, labels, classes=LABELS)
+        self.n_seen += len(texts)
+
+    def predict(self, texts: List[str]) -> List[str]:
+        X = self.vectorizer.transform(texts)
+        return [str(p) for p in self.clf.predict(X)]
+
+    def predict_with_confidence(self, text: str) -> Tuple[Optional[str], float]:
+        if self.n_seen == 0:
+            return None, 0.0
+        proba = self.clf.predict_proba(self.vectorizer.transform([text]))[0]
+        best = max(range(len(proba)), key=lambda i: proba[i])
+        return str(self.clf.classes_[best]), float(proba[best])
+
+
+def _is_holdout(doc_id: str) -> bool:
+    # Deterministic split so a document never moves between train and holdout.
+    digest = hashlib.md5(doc_id.encode("utf-8")).digest()
+    return digest[0] % max(DISTILL_HOLDOUT_EVERY, 1) == 0
+
+
+def evaluate(model: Optional[DistilledModel], holdout: List[Tuple[str, str, Optional[str]]]) -> Dict[str, float]:
+    """Score the offline stage (distilled model + fallback) against LLM labels.
+
+    `holdout` rows are (text, online_label, fallback_label). A decision is
+    "offloaded" when the offline stage returns Fraud/Not Fraud, i.e. when
+    route_after_offline would skip the online stage.
+    """
+    from offline_model import offline_model
+
+    n = len(holdout)
+    correct = wrong = 0
+    for text, online_label, fallback in holdout:
+        label = fallback
+        if model is not None and (label is None or label == "Mediate"):
+            label = offline_model.predict_distilled(text, model) or label
+        if label is None or label == "Mediate":
+            continue
+        if label == online_label:
+            correct += 1
+        else:
+            wrong += 1
+    return {
+        "n": float(n),
+        "offload_correct": correct / n if n else 0.0,
+        "offload_error": wrong / n if n else 0.0,
+    }
+
+
+def beats(candidate: Dict[str, float], current: Dict[str, float]) -> bool:
+    # Never raise the error rate, and never exceed the absolute ceiling.
+    if candidate["offload_error"] > current["offload_error"]:
+        return False
+    if candidate["offload_error"] > DISTILL_MAX_ERROR_RATE:
+        return False
+    return candidate["offload_correct"] > current["offload_correct"]
+
+
+def save_model_atomic(model: DistilledModel, path: str) -> None:
+    """Write to a temp file in the target directory, then rename over `path`."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".distilled-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(model, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DistillLearner(threading.Thread):
+    """Background loop that distills online (LLM) verdicts into the offline stage.
+
+    Each cycle pulls newly processed documents with an online label, splits them
+    into train/holdout, partial_fits a working copy of the current model and promotes
+    it only if it offloads more holdout traffic correctly without raising the
+    error rate.
+    """
+
+    def __init__(self, interval_sec: int = DISTILL_INTERVAL_SEC):
+        super().__init__(daemon=True)
+        self.interval = interval_sec
+        self._stop_event = threading.Event()
+        # Keyset cursor over (updated_at, _id); updated_at is in whole seconds.
+        self._since = 0
+        self._after_id = None
+        self.holdout: deque = deque(maxlen=DISTILL_HOLDOUT_MAX)
+        self.last_metrics: Dict[str, Any] = {}
+        # Accumulates training across cycles; only a copy is ever made live.
+        self._working: Optional[DistilledModel] = None
+
+    def collect(self) -> Tuple[List[str], List[str]]:
+        from db import find_distill_samples
+        from offline_model import offline_model
+
+        docs = find_distill_samples(since=self._since, after_id=self._after_id, limit=DISTILL_BATCH_LIMIT)
+        texts: List[str] = []
+        labels: List[str] = []
+        for doc in docs:
+            doc_id = str(doc.get("_id"))
+            self._since = int(doc.get("updated_at") or 0)
+            self._after_id = doc.get("_id")
+
+            text = doc.get("message") or ""
+            label = (doc.get("meta") or {}).get("online_label")
+            if not text or label not in LABELS:
+                continue
+            if _is_holdout(doc_id):
+                fallback = offline_model.predict(text, use_distilled=False)
+                self.holdout.append((text, label, fallback))
+            else:
+                texts.append(text)
+                labels.append(label)
+        return texts, labels
+
+    def step(self) -> bool:
+        """Run one collect/train/validate cycle. Returns True if a model was promoted."""
+        import offline_model as om
+
+        texts, labels = self.collect()
+        if not texts:
+            return False
+
+        current = om.distilled_model
+        if self._working is None:
+            self._working = copy.deepcopy(current) if current is not None else DistilledModel()
+        candidate = self._working
+        candidate.partial_fit(texts, labels)
+        logger.info("Distill: trained on %d new samples (total=%d)", len(texts), candidate.n_seen)
+
+        holdout = list(self.holdout)
+        if len(holdout) < DISTILL_MIN_HOLDOUT:
+            logger.info("Distill: holdout too small (%d < %d); not promoting", len(holdout), DISTILL_MIN_HOLDOUT)
+            return False
+
+        cur_metrics = evaluate(current, holdout)
+        cand_metrics = evaluate(candidate, holdout)
+        self.last_metrics = {"current": cur_metrics, "candidate": cand_metrics}
+        logger.info("Distill: current=%s candidate=%s", cur_metrics, cand_metrics)
+        if not beats(cand_metrics, cur_metrics):
+            return False
+
+        try:
+            save_model_atomic(candidate, om.DISTILLED_MODEL_PATH)
+        except Exception as e:
+            logger.error("Distill: failed to persist candidate: %s", e)
+            return False
+        om.set_distilled_model(copy.deepcopy(candidate))
+        logger.info("Distill: promoted candidate (n_seen=%d)", candidate.n_seen)
+        return True
+
+    def run(self):
+        if SGDClassifier is None:
+            logger.warning("scikit-learn not available; distill learner disabled.")
+            return
+        logger.info("Distill learner started (interval=%ss)", self.interval)
+        while not self._stop_event.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                logger.error("Distill learner loop error: %s", e)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,32 @@
+import os
+
+# Largest request body accepted by the HTTP endpoints (Flask MAX_CONTENT_LENGTH).
+MAX_BODY_BYTES = int(os.getenv("UPAY_MAX_BODY_BYTES", str(64 * 1024)))
+# Longest message text handed to the agent and stored; longer text keeps head and tail.
+MAX_TEXT_CHARS = int(os.getenv("UPAY_MAX_TEXT_CHARS", "4000"))
+# Share of the budget kept from the start of the text; scam hooks tend to sit
+# up front while links and phone numbers often trail at the end.
+HEAD_FRACTION = float(os.getenv("UPAY_TRUNCATE_HEAD_FRACTION", "0.7"))
+TRUNCATION_MARKER = " ... "
+
+
+def truncate_head_tail(text: str, max_chars: int = MAX_TEXT_CHARS) -> str:
+    """Cut `text` to at most `max_chars`, keeping the head and tail and preferring
+    whitespace boundaries so words are not split."""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    budget = max_chars - len(TRUNCATION_MARKER)
+    if budget <= 0:
+        return text[:max_chars]
+    head_len = int(budget * HEAD_FRACTION)
+    tail_len = budget - head_len
+
+    head = text[:head_len]
+    cut = head.rfind(" ")
+    if cut > head_len // 2:
+        head = head[:cut]
+    tail = text[len(text) - tail_len:] if tail_len > 0 else ""
+    cut = tail.find(" ")
+    if 0 <= cut < tail_len // 2:
+        tail = tail[cut + 1:]
+    return head + TRUNCATION_MARKER + tail
@@ -24,10 +24,39 @@ except Exception as e:
     logger.error("Failed to load local model: %s; falling back to heuristics", e)
     local_model = None
 
+# Incrementally distilled model (see distill.py); consulted only where the
+# offline stage would route online, and only when confident about a non-Mediate label.
+DISTILLED_MODEL_PATH = os.getenv(
+    "UPAY_DISTILLED_MODEL_PATH", os.path.join(os.path.dirname(__file__), "distilled_model.pkl")
+)
+DISTILLED_MIN_CONFIDENCE = float(os.getenv("UPAY_DISTILLED_MIN_CONFIDENCE", "0.85"))
+distilled_model = None
+try:
+    if os.path.exists(DISTILLED_MODEL_PATH):
+        with open(DISTILLED_MODEL_PATH, "rb") as f:
+            distilled_model = pickle.load(f)
+        logger.info("Loaded distilled model from %s", DISTILLED_MODEL_PATH)
+except Exception as e:
+    logger.error("Failed to load distilled model: %s; ignoring it", e)
+    distilled_model = None
+
+
+def set_distilled_model(model) -> None:
+    """Swap the in-memory distilled model (a single reference assignment)."""
+    global distilled_model
+    distilled_model = model
+    logger.info("Distilled model swapped in: %s", type(model).__name__ if model is not None else None)
+
+
+# Every heuristic pattern is written so Python's backtracking engine stays
+# linear in the input: no nested quantifiers, and unbounded runs may only start
+# at one position (anchored with ^ or a lookbehind) so a failed match cannot be
+# retried from every offset.
 SAFE_PATTERNS = [
     r"UPI payment received",
     r"credited to your account",
-    r"debit of INR .* via UPI",
+    # Equivalent to "debit of INR .* via UPI", tried only from the first occurrence.
+    r"^(?:(?!debit of INR ).)*debit of INR .* via UPI",
     r"transaction id|txn id|utr",
     r"payment successful",
     r"thank you for using",
@@ -47,6 +76,12 @@ MEDIATE_SIGNALS = [
     "unknown", "unexpected", "strange", "suspicious",
 ]
 
+_SAFE_RES = [re.compile(pat) for pat in SAFE_PATTERNS]
+_LINK_RE = re.compile(r"https?://|\bbit\.ly\b|tinyurl|\.link\b|\d{10}\b")
+_AMOUNT_RE = re.compile(r"inr\s*\d+|rs\.?\s*\d+|\b\d{3,}\b")
+# Lookbehind pins the start to the beginning of a run, keeping failed matches linear.
+_HANDLE_RE = re.compile(r"(?<![a-z0-9_.-])[a-z0-9_.-]+@[a-z]+")
+
 
 class OfflineHeuristicModel:
     """Lightweight, offline-only heuristic model for fraud detection.
@@ -58,31 +93,63 @@ class OfflineHeuristicModel:
 
     @staticmethod
     def normalize(txt: str) -> str:
-        return re.sub(r"\s+", " ", txt.strip().lower())
+        # split()/join collapses any whitespace run in one C-level pass, without a regex.
+        return " ".join(txt.lower().split())
 
     def score(self, text: str) -> int:
-        t = self.normalize(text)
+        return self._score_normalized(self.normalize(text))
+
+    @staticmethod
+    def _score_normalized(t: str) -> int:
         score = 0
         for kw in FRAUD_KEYWORDS:
             if kw in t:
                 score += 2
-        if re.search(r"https?://|\bbit\.ly\b|tinyurl|\.link\b|\d{10}\b", t):
+        if _LINK_RE.search(t):
             score += 3
-        if re.search(r"inr\s*\d+|rs\.?\s*\d+|\b\d{3,}\b", t) and ("urgent" in t or "immediately" in t):
+        if ("urgent" in t or "immediately" in t) and _AMOUNT_RE.search(t):
             score += 2
-        if re.search(r"[a-z0-9_.-]+@[a-z]+", t):
+        if "@" in t and _HANDLE_RE.search(t):
             score += 1
         return score
 
     def is_safe_like(self, text: str) -> bool:
-        t = self.normalize(text)
-        return any(re.search(pat, t) for pat in SAFE_PATTERNS)
+        return self._is_safe_like_normalized(self.normalize(text))
 
-    def predict(self, text: str) -> Optional[str]:
+    @staticmethod
+    def _is_safe_like_normalized(t: str) -> bool:
+        return any(rx.search(t) for rx in _SAFE_RES)
+
+    @staticmethod
+    def predict_distilled(text: str, model=None) -> Optional[str]:
+        """Return the distilled model's label when it is confident, else None."""
+        model = model if model is not None else distilled_model
+        if model is None:
+            return None
         try:
-            if not text or not text.strip():
-                return None
+            label, confidence = model.predict_with_confidence(text)
+        except Exception as e:
+            logger.warning("Distilled model prediction failed: %s", e)
+            return None
+        if label and label != "Mediate" and confidence >= DISTILLED_MIN_CONFIDENCE:
+            return label
+        return None
 
+    def predict(self, text: str, use_distilled: bool = True) -> Optional[str]:
+        if not text or not text.strip():
+            return None
+        label = self._predict_offline(text)
+        # The distilled model only learns from traffic the offline stage routed
+        # online, so it may only stand in for that hop, never override a decision.
+        if use_distilled and (label is None or label.strip().lower() == "mediate"):
+            distilled = self.predict_distilled(text)
+            if distilled:
+                logger.info("Distilled model prediction: %s", distilled)
+                return distilled
+        return label
+
+    def _predict_offline(self, text: str) -> Optional[str]:
+        try:
             if local_model is not None:
                 try:
                     pred = local_model.predict([text])
@@ -105,10 +172,10 @@ class OfflineHeuristicModel:
                     logger.warning("Local model prediction failed, falling back to heuristics: %s", e)
 
             t = self.normalize(text)
-            score = self.score(t)
+            score = self._score_normalized(t)
             logger.debug("Offline score: %s", score)
 
-            if self.is_safe_like(t) and score <= 1:
+            if score <= 1 and self._is_safe_like_normalized(t):
                 return "Not Fraud"
             if score >= 5:
                 return "Fraud"
@@ -1,6 +1,7 @@
 import os
 from typing import Optional
 from utils_logger import setup_logger
+from input_limits import truncate_head_tail
 
 try:
     import google.generativeai as genai
@@ -11,6 +12,18 @@ logger = setup_logger("upay.online")
 
 ALLOWED = {"fraud": "Fraud", "not fraud": "Not Fraud", "mediate": "Mediate"}
 
+# Prompt budget for Gemini, in tokens (estimated at ~4 characters per token).
+LLM_MAX_PROMPT_TOKENS = int(os.getenv("UPAY_LLM_MAX_PROMPT_TOKENS", "1024"))
+LLM_MAX_OUTPUT_TOKENS = int(os.getenv("UPAY_LLM_MAX_OUTPUT_TOKENS", "8"))
+CHARS_PER_TOKEN = 4
+# Floor for the text share of the prompt when the budget barely covers the template.
+LLM_MIN_TEXT_CHARS = 64
+PROMPT_TEMPLATE = (
+    "You are an expert fraud classifier. Classify the given text as exactly one of: "
+    "Fraud, Not Fraud, Mediate. Reply with ONLY one of these EXACT labels.\n\n"
+    "Text: {text}\n\nAnswer:"
+)
+
 
 def normalize_label(label: str) -> Optional[str]:
     if not label:
@@ -37,11 +50,7 @@ class OnlineLLM:
         self.prompt_tmpl = None
         try:
             from langchain_core.prompts import PromptTemplate  # type: ignore
-            self.prompt_tmpl = PromptTemplate.from_template(
-                "You are an expert fraud classifier. Classify the given text as exactly one of: "
-                "Fraud, Not Fraud, Mediate. Reply with ONLY one of these EXACT labels.\n\n"
-                "Text: {text}\n\nAnswer:"
-            )
+            self.prompt_tmpl = PromptTemplate.from_template(PROMPT_TEMPLATE)
         except Exception:
             self.prompt_tmpl = None
 
@@ -60,23 +69,27 @@ class OnlineLLM:
             logger.error("Failed to initialize Gemini model: %s", e)
             self.enabled = False
 
+    def _budget_text(self, text: str) -> str:
+        """Fit `text` into the prompt budget, keeping its head and tail."""
+        overhead = len(PROMPT_TEMPLATE) - len("{text}")
+        max_chars = LLM_MAX_PROMPT_TOKENS * CHARS_PER_TOKEN - overhead
+        budgeted = truncate_head_tail(text, max(max_chars, LLM_MIN_TEXT_CHARS))
+        if len(budgeted) < len(text):
+            logger.info("Online prompt text truncated from %d to %d chars", len(text), len(budgeted))
+        return budgeted
+
     def _classify(self, text: str) -> str:
+        text = self._budget_text(text)
         if self.prompt_tmpl is not None:
             try:
                 prompt = self.prompt_tmpl.format(text=text)
             except Exception:
-                prompt = (
-                    "You are an expert fraud classifier. Classify the given text as exactly one of: "
-                    "Fraud, Not Fraud, Mediate. Reply with ONLY one of these EXACT labels.\n\n"
-                    f"Text: {text}\n\nAnswer:"
-                )
+                prompt = PROMPT_TEMPLATE.format(text=text)
         else:
-            prompt = (
-                "You are an expert fraud classifier. Classify the given text as exactly one of: "
-                "Fraud, Not Fraud, Mediate. Reply with ONLY one of these EXACT labels.\n\n"
-                f"Text: {text}\n\nAnswer:"
-            )
-        resp = self.model.generate_content(prompt)
+            prompt = PROMPT_TEMPLATE.format(text=text)
+        resp = self.model.generate_content(
+            prompt, generation_config={"max_output_tokens": LLM_MAX_OUTPUT_TOKENS}
+        )
         raw = None
         try:
             raw = getattr(resp, "text", None)
@@ -0,0 +1,296 @@
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, List, Iterator
+
+from utils_logger import setup_logger
+
+logger = setup_logger("upay.profiler")
+
+ADMIN_TOKEN = os.getenv("UPAY_ADMIN_TOKEN", "")
+TRACE_BUFFER_SIZE = int(os.getenv("UPAY_TRACE_BUFFER_SIZE", "5000"))
+MAX_PROFILE_SECONDS = float(os.getenv("UPAY_MAX_PROFILE_SECONDS", "300"))
+
+_trace_id: contextvars.ContextVar = contextvars.ContextVar("upay_trace_id", default=None)
+
+
+def _frame_label(code) -> str:
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class ProfileSession:
+    """One profiling run, bounded by a request count and/or wall-clock time.
+
+    mode="sample" walks sys._current_frames() every `interval` seconds from a
+    helper thread and aggregates stacks across threads; mode="cprofile" runs
+    cProfile around each profiled request and merges the stats; mode="trace"
+    only records spans.
+    """
+
+    def __init__(self, mode: str = "sample", requests: Optional[int] = None, seconds: Optional[float] = None,
+                 interval_ms: float = 5.0, all_threads: bool = False, trace: bool = False) -> None:
+        if mode not in ("sample", "cprofile", "trace"):
+            raise ValueError("mode must be 'sample', 'cprofile' or 'trace'")
+        self.mode = mode
+        self.requests_limit = requests
+        self.seconds = min(seconds if seconds else MAX_PROFILE_SECONDS, MAX_PROFILE_SECONDS)
+        self.interval = max(interval_ms, 1.0) / 1000.0
+        self.all_threads = all_threads
+        self.trace = trace or mode == "trace"
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + self.seconds
+        self.stopped_at: Optional[float] = None
+        self.requests_profiled = 0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.stats: Optional[pstats.Stats] = None
+        self._active_threads: set = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        if self._stop_event.is_set():
+            return False
+        if time.monotonic() >= self.deadline:
+            self.stop()
+            return False
+        return True
+
+    def start(self) -> None:
+        if self.mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name="upay-sampler", daemon=True)
+            self._sampler.start()
+        logger.info("Profiling started (mode=%s, requests=%s, seconds=%s, trace=%s)",
+                    self.mode, self.requests_limit, self.seconds, self.trace)
+
+    def stop(self) -> None:
+        if self._stop_event.is_set():
+            return
+        self._stop_event.set()
+        self.stopped_at = time.time()
+        logger.info("Profiling stopped after %d requests, %d samples", self.requests_profiled, self.samples)
+
+    def _sample_loop(self) -> None:
+        own = threading.get_ident()
+        while not self._stop_event.wait(self.interval):
+            if time.monotonic() >= self.deadline:
+                self.stop()
+                break
+            with self._lock:
+                wanted = None if self.all_threads else set(self._active_threads)
+            if wanted is not None and not wanted:
+                continue
+            for ident, frame in sys._current_frames().items():
+                if ident == own or (wanted is not None and ident not in wanted):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                with self._lock:
+                    self.stacks[";".join(stack)] += 1
+                    self.samples += 1
+
+    def enter_request(self) -> Optional[cProfile.Profile]:
+        with self._lock:
+            self._active_threads.add(threading.get_ident())
+        if self.mode == "cprofile":
+            prof = cProfile.Profile()
+            try:
+                prof.enable()
+            except ValueError as e:
+                # Only one profiler may be active at a time on newer interpreters.
+                logger.debug("cProfile unavailable for this request: %s", e)
+                return None
+            return prof
+        return None
+
+    def exit_request(self, prof: Optional[cProfile.Profile]) -> None:
+        if prof is not None:
+            prof.disable()
+        with self._lock:
+            self._active_threads.discard(threading.get_ident())
+            if prof is not None:
+                if self.stats is None:
+                    self.stats = pstats.Stats(prof)
+                else:
+                    self.stats.add(prof)
+            self.requests_profiled += 1
+            done = self.requests_limit is not None and self.requests_profiled >= self.requests_limit
+        if done or time.monotonic() >= self.deadline:
+            self.stop()
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed-stack format, one `stack count` per line."""
+        with self._lock:
+            items = sorted(self.stacks.items(), key=lambda kv: kv[1], reverse=True)
+        return "\n".join("%s %d" % (stack, count) for stack, count in items)
+
+    def top(self, n: int = 25) -> List[Dict[str, Any]]:
+        if self.mode == "cprofile":
+            with self._lock:
+                if self.stats is None:
+                    return []
+                raw = dict(self.stats.stats)  # type: ignore[attr-defined]
+            rows = []
+            for (filename, lineno, func), (cc, nc, tt, ct, _callers) in raw.items():
+                rows.append({
+                    "function": "%s (%s:%d)" % (func, os.path.basename(filename), lineno),
+                    "calls": nc,
+                    "tottime_ms": round(tt * 1000, 3),
+                    "cumtime_ms": round(ct * 1000, 3),
+                })
+            rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+            return rows[:n]
+
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        with self._lock:
+            items = list(self.stacks.items())
+            samples = self.samples
+        for stack, count in items:
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            for f in set(frames):
+                total_counts[f] += count
+        rows = []
+        for func, own in self_counts.most_common(n):
+            total = total_counts[func]
+            rows.append({
+                "function": func,
+                "self_samples": own,
+                "self_pct": round(100.0 * own / samples, 2) if samples else 0.0,
+                "total_samples": total,
+                "total_pct": round(100.0 * total / samples, 2) if samples else 0.0,
+            })
+        return rows
+
+    def pstats_text(self, n: int = 25) -> str:
+        with self._lock:
+            if self.stats is None:
+                return ""
+            buf = io.StringIO()
+            self.stats.stream = buf  # type: ignore[attr-defined]
+            self.stats.sort_stats("cumulative").print_stats(n)
+            return buf.getvalue()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "active": self.active,
+            "started_at": int(self.started_at),
+            "stopped_at": int(self.stopped_at) if self.stopped_at else None,
+            "requests_profiled": self.requests_profiled,
+            "requests_limit": self.requests_limit,
+            "seconds_limit": self.seconds,
+            "samples": self.samples,
+            "trace": self.trace,
+        }
+
+
+class Profiler:
+    """Process-wide profiling and tracing switchboard used by the admin endpoints."""
+
+    def __init__(self) -> None:
+        self.session: Optional[ProfileSession] = None
+        self.spans: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+        self._span_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, **kwargs) -> ProfileSession:
+        with self._lock:
+            if self.session is not None and self.session.active:
+                self.session.stop()
+            session = ProfileSession(**kwargs)
+            self.session = session
+        session.start()
+        return session
+
+    def stop(self) -> Optional[ProfileSession]:
+        session = self.session
+        if session is not None:
+            session.stop()
+        return session
+
+    @contextmanager
+    def profile_request(self, name: str = "request") -> Iterator[None]:
+        """Wrap one unit of work; profiled/traced only while a session is active."""
+        session = self.session
+        if session is None or not session.active:
+            yield
+            return
+        token = _trace_id.set(uuid.uuid4().hex) if session.trace else None
+        prof = session.enter_request()
+        try:
+            with self.span(name):
+                yield
+        finally:
+            session.exit_request(prof)
+            if token is not None:
+                _trace_id.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[None]:
+        trace_id = _trace_id.get()
+        if trace_id is None:
+            yield
+            return
+        start = time.time()
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.spans.append({
+                "span_id": next(self._span_ids),
+                "trace_id": trace_id,
+                "name": name,
+                "start": start,
+                "duration_ms": round((time.perf_counter() - t0) * 1000, 3),
+                "thread": threading.current_thread().name,
+                "error": error,
+                "attrs": attrs,
+            })
+
+    def traced(self, name: str):
+        """Decorator form of span() for graph nodes and DB calls."""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if _trace_id.get() is None:
+                    return fn(*args, **kwargs)
+                with self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def query_spans(self, trace_id: Optional[str] = None, name: Optional[str] = None,
+                    limit: int = 200) -> List[Dict[str, Any]]:
+        spans = list(self.spans)
+        if trace_id:
+            spans = [s for s in spans if s["trace_id"] == trace_id]
+        if name:
+            spans = [s for s in spans if s["name"] == name]
+        return spans[-limit:]
+
+
+profiler = Profiler()
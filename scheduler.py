@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional, Dict, Any, Callable, Deque, Tuple
+
+from utils_logger import setup_logger
+
+logger = setup_logger("upay.scheduler")
+
+# Lower rank runs first; aging lets waiting work overtake fresher, higher-priority work.
+PRIORITY_CLASSES = {"interactive": 0, "website": 1, "database": 2}
+SOURCE_CLASSES = {"app": "interactive", "terminal": "interactive", "website": "website", "database": "database"}
+
+SCHEDULER_WORKERS = int(os.getenv("UPAY_SCHEDULER_WORKERS", "8"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("UPAY_SCHEDULER_MAX_QUEUE", "500"))
+# Seconds of waiting worth one priority class.
+SCHEDULER_AGING_SEC = float(os.getenv("UPAY_SCHEDULER_AGING_SEC", "5"))
+# Max workers a class may occupy at once. Backlog work blocks for an online slot
+# rather than degrading, so keep this at or below its UPAY_ONLINE_CLASS_CAPS entry.
+SCHEDULER_CLASS_WORKERS = os.getenv("UPAY_SCHEDULER_CLASS_WORKERS", "database=3")
+WAIT_WINDOW = 512
+
+
+def _parse_caps(spec: str) -> Dict[str, int]:
+    caps: Dict[str, int] = {}
+    for part in spec.split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            caps[name.strip()] = max(1, int(value))
+        except ValueError:
+            logger.warning("Ignoring invalid scheduler class cap %r", part)
+    return caps
+
+
+class QueueFull(Exception):
+    """Raised by submit() when the class queue is at capacity."""
+
+
+def class_for_source(source: str) -> str:
+    # Unknown (client-supplied) sources must not be able to claim interactive priority.
+    return SOURCE_CLASSES.get(source, "website")
+
+
+class _ClassStats:
+    def __init__(self) -> None:
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.running = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_WINDOW)
+
+    def snapshot(self, depth: int) -> Dict[str, Any]:
+        waits = sorted(self.waits)
+        n = len(waits)
+        return {
+            "queue_depth": depth,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "wait_ms_avg": round(1000 * sum(waits) / n, 2) if n else 0.0,
+            "wait_ms_p95": round(1000 * waits[min(n - 1, int(n * 0.95))], 2) if n else 0.0,
+            "wait_ms_max": round(1000 * waits[-1], 2) if n else 0.0,
+        }
+
+
+class PriorityScheduler:
+    """Bounded worker pool shared by HTTP handlers and the DB poller.
+
+    Each priority class has its own FIFO queue. A free worker takes the head
+    whose rank minus (wait / SCHEDULER_AGING_SEC) is smallest, so backlog work
+    still makes progress under sustained interactive load. Classes listed in
+    SCHEDULER_CLASS_WORKERS never hold more than their share of the workers.
+    """
+
+    def __init__(self, workers: int = SCHEDULER_WORKERS, max_queue: int = SCHEDULER_MAX_QUEUE) -> None:
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queues: Dict[str, Deque[Tuple[float, Optional[float], Future, Callable, tuple, dict]]] = {
+            k: deque() for k in PRIORITY_CLASSES
+        }
+        self._stats: Dict[str, _ClassStats] = {k: _ClassStats() for k in PRIORITY_CLASSES}
+        self._class_caps = _parse_caps(SCHEDULER_CLASS_WORKERS)
+        self._cond = threading.Condition()
+        self._threads: list = []
+        self._started = False
+
+    def _ensure_started(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name="upay-worker-%d" % i, daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info("Scheduler started (workers=%d)", self.workers)
+
+    def submit(self, klass: str, fn: Callable, *args, deadline: Optional[float] = None, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) in `klass`; work still queued past `deadline` is dropped."""
+        if klass not in PRIORITY_CLASSES:
+            raise ValueError("unknown priority class %r" % klass)
+        fut: Future = Future()
+        with self._cond:
+            self._ensure_started()
+            queue = self._queues[klass]
+            if len(queue) >= self.max_queue:
+                self._stats[klass].rejected += 1
+                raise QueueFull("%s queue full (%d)" % (klass, len(queue)))
+            queue.append((time.monotonic(), deadline, fut, fn, args, kwargs))
+            self._stats[klass].submitted += 1
+            self._cond.notify()
+        return fut
+
+    def _pick(self):
+        now = time.monotonic()
+        best = None
+        best_score = None
+        for klass, queue in self._queues.items():
+            if not queue:
+                continue
+            cap = self._class_caps.get(klass)
+            if cap is not None and self._stats[klass].running >= cap:
+                continue
+            score = PRIORITY_CLASSES[klass] - (now - queue[0][0]) / SCHEDULER_AGING_SEC
+            if best_score is None or score < best_score:
+                best, best_score = klass, score
+        if best is None:
+            return None
+        return best, self._queues[best].popleft(), now
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                picked = self._pick()
+                while picked is None:
+                    self._cond.wait()
+                    picked = self._pick()
+                klass, (enqueued, deadline, fut, fn, args, kwargs), now = picked
+                stats = self._stats[klass]
+                stats.waits.append(now - enqueued)
+                expired = deadline is not None and now >= deadline
+                if expired:
+                    stats.expired += 1
+                else:
+                    stats.running += 1
+
+            ran = False
+            try:
+                if expired:
+                    # The waiter may already have given up and cancelled the future.
+                    if fut.set_running_or_notify_cancel():
+                        fut.set_exception(TimeoutError("%s work expired in queue" % klass))
+                elif fut.set_running_or_notify_cancel():
+                    ran = True
+                    try:
+                        fut.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        fut.set_exception(e)
+            except Exception as e:
+                # One bad item must never take a worker out of the pool.
+                logger.error("Scheduler worker error (%s): %s", klass, e)
+            finally:
+                if not expired:
+                    with self._cond:
+                        stats.running -= 1
+                        if ran:
+                            stats.completed += 1
+                        # A freed class slot may unblock work skipped by _pick.
+                        self._cond.notify()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {k: self._stats[k].snapshot(len(self._queues[k])) for k in PRIORITY_CLASSES}
+
+
+scheduler = PriorityScheduler()
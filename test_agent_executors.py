@@ -0,0 +1,84 @@
+"""Equivalence suite: the native executor must match the LangGraph graph."""
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+import agent  # noqa: E402
+import offline_model  # noqa: E402
+
+# Texts routed online (offline says Mediate/None) and what the stubbed LLM answers.
+ONLINE_ANSWERS = {
+    "something unknown arrived": "Fraud",
+    "a strange but harmless note": "Not Fraud",
+    "an unexpected message": None,
+    "suspicious request, please check": "Mediate",
+    "": None,
+}
+
+CASES = [
+    # (text, after_hours, expected origin)
+    ("URGENT verify your KYC now, click http://bit.ly/x or account blocked", False, "offline"),
+    ("see you at lunch tomorrow", False, "offline"),
+    ("something unknown arrived", False, "online"),
+    ("a strange but harmless note", False, "online"),
+    ("an unexpected message", False, "default"),
+    ("", False, "default"),
+    ("suspicious request, please check", False, "online"),
+    ("suspicious request, please check", True, "online"),
+    ("see you at lunch tomorrow", True, "offline"),
+    ("an unexpected message", True, "default"),
+]
+
+
+@pytest.fixture(autouse=True)
+def deterministic_models(monkeypatch):
+    monkeypatch.setattr(offline_model, "local_model", None)
+    monkeypatch.setattr(offline_model, "distilled_model", None)
+    monkeypatch.setattr(agent.online_llm, "predict", lambda text: ONLINE_ANSWERS.get(text))
+
+
+def _state(text, after_hours):
+    return {"input_text": text, "after_hours": after_hours, "deadline": None, "priority_class": "website"}
+
+
+def _assert_equivalent(states):
+    graph = agent.build_langgraph_agent()
+    native = agent.NativeAgent()
+    expected = [graph.invoke(dict(s)) for s in states]
+    single = [native.invoke(dict(s)) for s in states]
+    batched = native.batch([dict(s) for s in states])
+    assert len(batched) == len(states)
+    for exp, got_single, got_batch in zip(expected, single, batched):
+        for key in ("final_label", "meta"):
+            assert got_single.get(key) == exp.get(key)
+            assert got_batch.get(key) == exp.get(key)
+    return expected
+
+
+@pytest.mark.parametrize("text,after_hours,origin", CASES)
+def test_native_matches_langgraph(text, after_hours, origin):
+    (out,) = _assert_equivalent([_state(text, after_hours)])
+    assert out["meta"]["origin"] == origin
+
+
+def test_native_batch_matches_langgraph_mixed():
+    _assert_equivalent([_state(text, after_hours) for text, after_hours, _ in CASES])
+
+
+def test_after_hours_mediate_becomes_fraud():
+    (out,) = _assert_equivalent([_state("suspicious request, please check", True)])
+    assert out["final_label"] == "Fraud"
+
+
+@pytest.mark.parametrize("after_hours", [False, True])
+def test_degraded_matches_langgraph(monkeypatch, after_hours):
+    @contextmanager
+    def saturated(deadline=None, klass=None):
+        yield False
+
+    monkeypatch.setattr(agent.admission, "online_slot", saturated)
+    (out,) = _assert_equivalent([_state("something unknown arrived", after_hours)])
+    assert out["meta"]["origin"] == "degraded"
+    assert out["final_label"] == ("Fraud" if after_hours else "Mediate")
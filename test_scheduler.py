@@ -0,0 +1,84 @@
+"""PriorityScheduler: worker survival, class caps and aging."""
+import threading
+import time
+
+import pytest
+
+import scheduler as sched
+
+
+def _blocker(started: threading.Event, release: threading.Event):
+    def run():
+        started.set()
+        release.wait(5)
+        return "blocked"
+
+    return run
+
+
+def _occupy(pool: sched.PriorityScheduler, klass: str = "interactive"):
+    started, release = threading.Event(), threading.Event()
+    fut = pool.submit(klass, _blocker(started, release))
+    assert started.wait(2)
+    return fut, release
+
+
+def test_cancelled_expired_item_keeps_worker_alive():
+    pool = sched.PriorityScheduler(workers=1)
+    blocked, release = _occupy(pool)
+
+    expired = pool.submit("website", lambda: "late", deadline=time.monotonic() + 0.05)
+    time.sleep(0.1)
+    assert expired.cancel()  # what _admitted_process does once its deadline passes
+    release.set()
+    assert blocked.result(timeout=2) == "blocked"
+
+    assert pool.submit("website", lambda: "next").result(timeout=2) == "next"
+    assert all(t.is_alive() for t in pool._threads)
+    stats = pool.snapshot()["website"]
+    assert stats["expired"] == 1
+    assert stats["running"] == 0
+
+
+def test_expired_item_fails_with_timeout():
+    pool = sched.PriorityScheduler(workers=1)
+    _, release = _occupy(pool)
+    expired = pool.submit("website", lambda: "late", deadline=time.monotonic() + 0.05)
+    time.sleep(0.1)
+    release.set()
+    with pytest.raises(TimeoutError):
+        expired.result(timeout=2)
+
+
+def test_class_cap_leaves_workers_for_other_classes(monkeypatch):
+    monkeypatch.setattr(sched, "SCHEDULER_CLASS_WORKERS", "database=1")
+    pool = sched.PriorityScheduler(workers=2)
+    first, release = _occupy(pool, "database")
+
+    second_started = threading.Event()
+    second = pool.submit("database", second_started.set)
+    assert pool.submit("interactive", lambda: "fast").result(timeout=2) == "fast"
+    assert not second_started.is_set()
+    assert pool.snapshot()["database"]["running"] == 1
+
+    release.set()
+    first.result(timeout=2)
+    second.result(timeout=2)
+    assert second_started.is_set()
+
+
+@pytest.mark.parametrize("aging_sec,expected", [(1000.0, ["interactive", "database"]),
+                                                (0.01, ["database", "interactive"])])
+def test_aging_lets_waiting_backlog_overtake(monkeypatch, aging_sec, expected):
+    monkeypatch.setattr(sched, "SCHEDULER_AGING_SEC", aging_sec)
+    pool = sched.PriorityScheduler(workers=1)
+    _, release = _occupy(pool)
+
+    order = []
+    backlog = pool.submit("database", order.append, "database")
+    time.sleep(0.1)  # 10 aging periods at 0.01s: enough to outrank interactive
+    fresh = pool.submit("interactive", order.append, "interactive")
+    release.set()
+    backlog.result(timeout=2)
+    fresh.result(timeout=2)
+    assert order == expected
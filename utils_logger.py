@@ -5,7 +5,7 @@ import os
 
 def setup_logger(name: str = "upay", level: int = logging.INFO) -> logging.Logger:
     logger = logging.getLogger(name)
-    if logger.handlers
+    if logger.handlers:
         return logger
 
     logger.setLevel(level)